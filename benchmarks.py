@@ -0,0 +1,381 @@
+"""
+BENCHMARKS:
+timing comparisons between the current routines in data_io.py and the implementations they replaced, and a
+reproducible benchmark of the whole ingest pipeline on a synthetic Geolife shaped dataset (points/s and peak memory
+per stage)
+usage: python benchmarks.py [<path to .plt file>]
+(the equivalence checks of the readers run on a synthetic .plt file if no file is given)
+"""
+
+
+import os
+import sys
+import csv
+import time
+import tempfile
+import tracemalloc
+import numpy as np
+from datetime import datetime, timezone
+
+import data_io
+
+
+###################################################################
+# REFERENCE IMPLEMENTATIONS
+###################################################################
+
+
+def read_trajectory_csv(trajectory_path: str):
+    """
+    previous row by row implementation of data_io.read_trajectory
+    """
+    timestamps = []
+    longitudes = []
+    latitudes = []
+    altitudes = []
+
+    with open(trajectory_path, "r") as file:
+        reader = csv.reader(file, delimiter=",")
+
+        for counter, row in enumerate(reader):
+            # skip first 6 rows:
+            if counter <= 5:
+                continue
+
+            date = row[5].split("-")
+            time_ = row[6].split(":")
+            dt = datetime(int(date[0]), int(date[1]), int(date[2]), int(time_[0]), int(time_[1]), int(time_[2]))
+            timestamps.append(dt.timestamp())
+
+            latitudes.append(float(row[0]))
+            longitudes.append(float(row[1]))
+            altitudes.append(float(row[3]))
+
+    return timestamps, latitudes, longitudes, altitudes
+
+
+def consecutive_gps_distances(latitudes: list, longitudes: list):
+    """
+    previous per pair distance computation of data_io.create_training_data_distance_time
+    """
+    return [data_io.gps_distance([latitudes[i], longitudes[i]], [latitudes[i + 1], longitudes[i + 1]])
+            for i in range(len(latitudes) - 1)]
+
+
+def resample_segments_loop(times, distances, offsets, frequency: float):
+    """
+    per segment reference for data_io.resample_segments
+    """
+    resampled = []
+    for start, end in zip(offsets[:-1], offsets[1:]):
+        point_times = np.concatenate(([0], np.cumsum(np.maximum(times[start:end], 0))))
+        point_distances = np.concatenate(([0], np.cumsum(distances[start:end])))
+        sample_times = np.arange(int(np.floor(point_times[-1] * frequency)) + 1) / frequency
+        resampled.append(np.interp(sample_times, point_times, point_distances))
+    return resampled
+
+
+def parse_timestamps_datetime(dates: list, times: list):
+    """
+    previous timestamp parsing (one datetime per row), in UTC instead of local time to be comparable
+    """
+    timestamps = []
+    for date, time_ in zip(dates, times):
+        d = date.split("-")
+        t = time_.split(":")
+        dt = datetime(int(d[0]), int(d[1]), int(d[2]), int(t[0]), int(t[1]), int(t[2]), tzinfo=timezone.utc)
+        timestamps.append(dt.timestamp())
+    return timestamps
+
+
+###################################################################
+# HELPER FUNCTIONS
+###################################################################
+
+
+def time_function(function, *args, repetitions: int = 5):
+    """
+    @return:    best wall time of all repetitions [seconds] and the result of the last call
+    """
+    best = float("inf")
+    result = None
+    for _ in range(repetitions):
+        t_start = time.perf_counter()
+        result = function(*args)
+        best = min(best, time.perf_counter() - t_start)
+    return best, result
+
+
+def random_training_data(n_segments: int, mean_length: int, seed: int = 0):
+    """
+    @return:    times, distances and offsets of random segments in the layout of the training data store
+    """
+    rng = np.random.default_rng(seed)
+    lengths = rng.integers(1, 2 * mean_length, n_segments)
+    offsets = np.zeros(n_segments + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    times = rng.choice([1, 2, 5], offsets[-1]).astype(np.int32)
+    distances = rng.integers(0, 2000, offsets[-1]).astype(np.int32)
+    return times, distances, offsets
+
+
+def measure_stage(function, *args):
+    """
+    @return:    wall time [seconds] and peak traced memory [bytes] of function(*args), measured in separate runs
+                (tracemalloc slows down python code)
+    """
+    t_start = time.perf_counter()
+    function(*args)
+    seconds = time.perf_counter() - t_start
+
+    tracemalloc.start()
+    function(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, peak
+
+
+###################################################################
+# SYNTHETIC DATASET
+###################################################################
+
+
+# mean speed [m/s] of the movement types in the synthetic dataset:
+SYNTHETIC_MODES = {"walk": 1.4, "bike": 4.5, "bus": 8.0, "car": 12.0, "train": 22.0}
+
+
+def generate_synthetic_dataset(dataset_path: str, n_users: int = 4, n_files: int = 6, points_per_file: int = 5000,
+                               seed: int = 0):
+    """
+    writes Geolife shaped user directories: <dataset_path>/<user>/Trajectory/<yyyymmddHHMMSS>.plt and
+    <dataset_path>/<user>/labels.txt. every file consists of three movement parts with different types, each labeled
+    with a small unlabeled margin. the dataset only depends on the arguments (seed)
+
+    @return:    total number of points
+    """
+    rng = np.random.default_rng(seed)
+    modes = list(SYNTHETIC_MODES)
+    header = "Geolife trajectory\nWGS 84\nAltitude is in Feet\nReserved 3\n0,2,255,My Track,0,0,2,8421376\n0\n"
+
+    for user in range(n_users):
+        user_path = "{}/{:03d}".format(dataset_path, user)
+        os.makedirs(user_path + "/Trajectory", exist_ok=True)
+        label_rows = ["Start Time\tEnd Time\tTransportation Mode"]
+        t = 1224720000 + user * 86400     # 2008-10-23 00:00:00 UTC
+        latitude, longitude = 39.9 + 0.1 * rng.random(), 116.3 + 0.1 * rng.random()
+
+        for _ in range(n_files):
+            times = t + np.cumsum(rng.choice([1, 2, 5], points_per_file, p=[0.6, 0.3, 0.1]))
+            bounds = np.concatenate(([0], np.sort(rng.choice(np.arange(50, points_per_file - 50), 2, replace=False)),
+                                     [points_per_file]))
+            speeds = np.zeros(points_per_file)
+            for start, end in zip(bounds[:-1], bounds[1:]):
+                mode = modes[rng.integers(len(modes))]
+                speeds[start:end] = np.abs(SYNTHETIC_MODES[mode] * (1 + 0.3 * rng.standard_normal(end - start)))
+                margin = min(10, (times[end - 1] - times[start]) // 4)
+                label_rows.append("{}\t{}\t{}".format(label_time(times[start] + margin),
+                                                      label_time(times[end - 1] - margin), mode))
+
+            # random walk of the heading, distance of a step from speed and time difference:
+            headings = np.cumsum(0.2 * rng.standard_normal(points_per_file))
+            steps = speeds * np.diff(np.concatenate(([t], times)))
+            latitudes = latitude + np.degrees(np.cumsum(steps * np.cos(headings)) / data_io.R_EARTH)
+            longitudes = longitude + np.degrees(np.cumsum(steps * np.sin(headings)) / data_io.R_EARTH
+                                                / np.cos(np.radians(latitude)))
+            altitudes = rng.integers(0, 500, points_per_file)
+            days = times / 86400 + data_io.DAYS_1899_TO_1970
+            date_times = np.datetime_as_string(times.astype("datetime64[s]"), unit="s")
+
+            file_name = date_times[0].replace("-", "").replace("T", "").replace(":", "") + ".plt"
+            with open(user_path + "/Trajectory/" + file_name, "w") as file:
+                file.write(header)
+                file.writelines("{:.6f},{:.6f},0,{},{:.10f},{}\n".format(lat, long, alt, day,
+                                                                          date_time.replace("T", ","))
+                                for lat, long, alt, day, date_time in
+                                zip(latitudes, longitudes, altitudes, days, date_times))
+
+            latitude, longitude = latitudes[-1], longitudes[-1]
+            t = int(times[-1]) + int(rng.integers(3600, 6 * 3600))
+
+        with open(user_path + "/labels.txt", "w") as file:
+            file.write("\n".join(label_rows) + "\n")
+
+    return n_users * n_files * points_per_file
+
+
+def label_time(epoch: int):
+    """
+    @return:    "yyyy/mm/dd hh:mm:ss" (UTC) as used in labels.txt
+    """
+    return str(np.datetime64(int(epoch), "s")).replace("-", "/").replace("T", " ")
+
+
+def write_training_data_txt(target_directory: str):
+    """
+    writes the training data store of a user in the old training_data.txt format (input of read_training_data)
+    """
+    store = data_io.read_training_data_store(target_directory + "/" + data_io.TRAINING_DATA_STORE)
+    with open(target_directory + "/training_data.txt", "w") as file:
+        writer = csv.writer(file, delimiter=";")
+        for index in range(len(store.labels)):
+            times, distances, label = data_io.get_trajectory(store, index)
+            writer.writerow([label, times.tolist(), distances.tolist()])
+
+
+###################################################################
+# BENCHMARKS
+###################################################################
+
+
+def benchmark_read_trajectory(trajectory_path: str, repetitions: int = 5):
+    t_csv, reference = time_function(read_trajectory_csv, trajectory_path, repetitions=repetitions)
+    t_arrays, _ = time_function(data_io.read_trajectory_arrays, trajectory_path, repetitions=repetitions)
+    t_fast, _ = time_function(data_io.read_trajectory_arrays, trajectory_path, True, repetitions=repetitions)
+    t_wrapper, result = time_function(data_io.read_trajectory, trajectory_path, repetitions=repetitions)
+
+    # the wrapper has to stay compatible with the old reader (timestamps are UTC now, see benchmark_parse_timestamps):
+    for ref_column, column in zip(reference[1:], result[1:]):
+        assert np.allclose(ref_column, column), "read_trajectory differs from reference implementation"
+
+    n_points = len(reference[0])
+    print("read_trajectory ({} points):".format(n_points))
+    for name, t in [("csv reader (old)", t_csv), ("read_trajectory_arrays", t_arrays),
+                    ("  with fractional days", t_fast), ("read_trajectory", t_wrapper)]:
+        print("\t{:<24} {:8.2f}ms\t {:12.0f} points/s\t speedup: {:5.1f}x".format(
+            name, 1000 * t, n_points / t, t_csv / t))
+
+
+def benchmark_parse_timestamps(trajectory_path: str, repetitions: int = 5):
+    data = np.loadtxt(trajectory_path, delimiter=",", skiprows=6, usecols=(4, 5, 6), ndmin=1,
+                      dtype=[("days", np.float64), ("date", "U10"), ("time", "U8")])
+    dates, times = data["date"].tolist(), data["time"].tolist()
+
+    t_datetime, reference = time_function(parse_timestamps_datetime, dates, times, repetitions=repetitions)
+    t_cached, result = time_function(data_io.parse_timestamps, dates, times, repetitions=repetitions)
+    t_days, result_days = time_function(data_io.fractional_days_to_epoch, data["days"], repetitions=repetitions)
+
+    # deterministic UTC values, the fractional days have to match the date / time columns:
+    assert np.array_equal(np.array(reference, dtype=np.int64), result), "parse_timestamps differs from datetime"
+    assert np.array_equal(result, result_days), "fractional days differ from date / time columns"
+
+    n_points = len(dates)
+    print("parse_timestamps ({} points):".format(n_points))
+    for name, t in [("datetime per row (old)", t_datetime), ("parse_timestamps", t_cached),
+                    ("fractional_days_to_epoch", t_days)]:
+        print("\t{:<24} {:8.2f}ms\t {:12.0f} points/s\t speedup: {:5.1f}x".format(
+            name, 1000 * t, n_points / t, t_datetime / t))
+
+
+def benchmark_gps_segment_distances(trajectory_path: str, repetitions: int = 3):
+    _, latitudes, longitudes, _ = data_io.read_trajectory_arrays(trajectory_path)
+
+    t_pairwise, reference = time_function(consecutive_gps_distances, latitudes.tolist(), longitudes.tolist(),
+                                          repetitions=repetitions)
+    t_vectorized, result = time_function(data_io.gps_segment_distances, latitudes, longitudes,
+                                         repetitions=repetitions)
+
+    # numerical equivalence with gps_distance (sub millimeter):
+    max_deviation = np.max(np.abs(np.array(reference) - result)) if len(reference) > 0 else 0.0
+    assert max_deviation < 1e-6, "gps_segment_distances deviates by {}m from gps_distance".format(max_deviation)
+
+    n_segments = len(reference)
+    print("gps_segment_distances ({} segments, max deviation {:.2e}m):".format(n_segments, max_deviation))
+    for name, t in [("gps_distance per pair", t_pairwise), ("gps_segment_distances", t_vectorized)]:
+        print("\t{:<24} {:8.2f}ms\t {:12.0f} segments/s\t speedup: {:5.1f}x".format(
+            name, 1000 * t, n_segments / t, t_pairwise / t))
+
+
+def benchmark_resample_segments(n_segments: int = 2000, mean_length: int = 500, frequency: float = 0.2,
+                                repetitions: int = 3):
+    times, distances, offsets = random_training_data(n_segments, mean_length)
+
+    t_loop, reference = time_function(resample_segments_loop, times, distances, offsets, frequency,
+                                      repetitions=repetitions)
+    t_batched, (samples, sample_offsets) = time_function(data_io.resample_segments, times, distances, offsets,
+                                                         frequency, repetitions=repetitions)
+    t_windows, _ = time_function(data_io.cut_windows, samples, sample_offsets, 60, repetitions=repetitions)
+
+    assert np.allclose(np.concatenate(reference), samples), "resample_segments differs from per segment reference"
+
+    print("resample_segments ({} segments, {} points, {} samples):".format(n_segments, offsets[-1], len(samples)))
+    for name, t in [("np.interp per segment", t_loop), ("resample_segments", t_batched),
+                    ("resample + cut_windows", t_batched + t_windows)]:
+        print("\t{:<24} {:8.2f}ms\t {:12.0f} segments/s\t speedup: {:5.1f}x".format(
+            name, 1000 * t, n_segments / t, t_loop / t))
+
+
+def benchmark_pipeline(dataset_path: str, workers: int = 2):
+    """
+    benchmark of all ingest stages on a (synthetic) dataset, plus an instrumented parallel run (see
+    data_io.enable_instrumentation) showing the per stage and per user timings of a real run
+    """
+    directories = sorted(dataset_path + "/" + user for user in os.listdir(dataset_path))
+    trajectory_paths = [directory + "/Trajectory/" + name for directory in directories
+                        for name in data_io.trajectory_file_names(directory)]
+    n_points = sum(len(data_io.read_trajectory_arrays(path)[0]) for path in trajectory_paths)
+
+    # instrumented run (first build of all artifacts):
+    data_io.enable_instrumentation()
+    data_io.STAGE_TIMINGS.clear()
+    data_io.print_pipeline_summary(data_io.run_pipeline(data_io.create_training_data_distance_time, directories,
+                                                        workers=workers))
+    data_io.print_timing_report()
+    data_io.enable_instrumentation(False)
+
+    for directory in directories:
+        write_training_data_txt(directory)
+    n_stored = sum(int(data_io.read_training_data_store(directory + "/" + data_io.TRAINING_DATA_STORE).offsets[-1])
+                   for directory in directories)
+
+    def for_all(function, arguments, **kwargs):
+        return lambda: [function(argument, **kwargs) for argument in arguments]
+
+    stages = [("read_trajectory_arrays", for_all(data_io.read_trajectory_arrays, trajectory_paths), n_points),
+              ("read_trajectory", for_all(data_io.read_trajectory, trajectory_paths), n_points),
+              ("label_trajectories", for_all(data_io.label_trajectories, directories, force=True), n_points),
+              ("create_training_data_distance_time",
+               for_all(data_io.create_training_data_distance_time, directories, force=True), n_points),
+              ("read_training_data (txt)",
+               for_all(data_io.read_training_data, [directory + "/training_data.txt" for directory in directories]),
+               n_stored),
+              ("read_training_data_store",
+               for_all(data_io.read_training_data_store,
+                       [directory + "/" + data_io.TRAINING_DATA_STORE for directory in directories], mmap=False),
+               n_stored),
+              ("extract_features", for_all(data_io.extract_features, directories, force=True), n_points)]
+
+    print("pipeline ({} users, {} files, {} points, {} stored time differences):".format(
+        len(directories), len(trajectory_paths), n_points, n_stored))
+    for name, function, n in stages:
+        seconds, peak = measure_stage(function)
+        print("\t{:<36} {:8.2f}ms\t {:12.0f} points/s\t peak memory: {:8.1f}MB".format(
+            name, 1000 * seconds, n / seconds, peak / 2**20))
+
+
+###################################################################
+# ENTRY POINT
+###################################################################
+
+
+def main():
+    with tempfile.TemporaryDirectory() as dataset_path:
+        generate_synthetic_dataset(dataset_path)
+
+        # equivalence checks and benchmarks of the readers, on real data if a .plt file is given:
+        if len(sys.argv) > 1:
+            trajectory_path = sys.argv[1]
+        else:
+            user_path = dataset_path + "/" + sorted(os.listdir(dataset_path))[0]
+            trajectory_path = user_path + "/Trajectory/" + data_io.trajectory_file_names(user_path)[0]
+        benchmark_read_trajectory(trajectory_path)
+        benchmark_parse_timestamps(trajectory_path)
+        benchmark_gps_segment_distances(trajectory_path)
+
+        # benchmarks on random data:
+        benchmark_resample_segments()
+
+        benchmark_pipeline(dataset_path)
+
+
+if __name__ == '__main__':
+    main()
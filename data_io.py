@@ -10,69 +10,255 @@ bot in units of (fractional) degrees (NOT: minute/second)
 import os
 import shutil
 import csv
+import json
+import hashlib
+import calendar
 import math
+import time
+import traceback
+import functools
+from collections import namedtuple
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 import numpy as np
 from sklearn.metrics.pairwise import haversine_distances
 import matplotlib.pyplot as plt
-from datetime import datetime
+from matplotlib.figure import Figure
 from tqdm import tqdm
 
+try:
+    import fcntl    # only needed for reflinks (not available on windows)
+except ImportError:
+    fcntl = None
+
+
+R_EARTH = 6371000    # earth radius in meter
+
+# columns of a .plt file used by read_trajectory_arrays (latitude, longitude, altitude, date, time):
+PLT_DTYPE = np.dtype([("latitude", np.float64), ("longitude", np.float64), ("altitude", np.float64),
+                      ("date", "U10"), ("time", "U8")])
+# columns used by the fast path of read_trajectory_arrays (latitude, longitude, altitude, days since 1899-12-30):
+PLT_DTYPE_FAST = np.dtype([("latitude", np.float64), ("longitude", np.float64), ("altitude", np.float64),
+                           ("days", np.float64)])
+DAYS_1899_TO_1970 = 25569
+
+# ioctl request to clone a file (linux/fs.h), used for reflinks:
+FICLONE = 0x40049409
+
+# epoch [s] of every day parsed so far, see day_epoch:
+DAY_EPOCH_CACHE = {}
+
+
+###################################################################
+# INSTRUMENTATION
+###################################################################
+# opt-in timing of the pipeline stages: enable_instrumentation() (or setting the environment variable
+# GPSLABELS_INSTRUMENTATION=1, also inherited by the worker processes of run_pipeline) records the wall time of every
+# call of an @instrumented stage together with the user currently processed in STAGE_TIMINGS
+
+
+INSTRUMENTATION_VARIABLE = "GPSLABELS_INSTRUMENTATION"
+
+# records {"stage": ..., "user": ..., "seconds": ...} of this process:
+STAGE_TIMINGS = []
+
+# user directory name of the run_pipeline task currently executed in this process:
+CURRENT_USER = ""
+
+
+def enable_instrumentation(enabled: bool = True):
+    os.environ[INSTRUMENTATION_VARIABLE] = "1" if enabled else "0"
+
+
+def instrumentation_enabled():
+    return os.environ.get(INSTRUMENTATION_VARIABLE, "0") not in ("", "0")
+
+
+@contextmanager
+def stage_timer(stage: str):
+    if not instrumentation_enabled():
+        yield
+        return
+    t_start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_TIMINGS.append({"stage": stage, "user": CURRENT_USER, "seconds": time.perf_counter() - t_start})
+
+
+def instrumented(function):
+    """
+    decorator recording the time of every call of function as stage function.__name__ (if instrumentation is enabled)
+    """
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        with stage_timer(function.__name__):
+            return function(*args, **kwargs)
+    return wrapper
+
+
+def timing_report(timings: list = None):
+    """
+    @return:    total seconds and number of calls per stage, total seconds per user and stage
+    """
+    stages, users = {}, {}
+    for record in STAGE_TIMINGS if timings is None else timings:
+        stage = stages.setdefault(record["stage"], {"seconds": 0.0, "calls": 0})
+        stage["seconds"] += record["seconds"]
+        stage["calls"] += 1
+        user = users.setdefault(record["user"], {})
+        user[record["stage"]] = user.get(record["stage"], 0.0) + record["seconds"]
+    return {"stages": stages, "users": users}
+
+
+def print_timing_report(timings: list = None, slowest_users: int = 10):
+    report = timing_report(timings)
+    print("Stage timings:")
+    for stage, values in sorted(report["stages"].items(), key=lambda item: -item[1]["seconds"]):
+        print("\t{:<44} {:10.3f}s\t calls: {}".format(stage, values["seconds"], values["calls"]))
+
+    # the whole task of a user is recorded as stage "user:<function name>" by run_user_task:
+    totals = {user: sum(seconds for stage, seconds in stages.items() if stage.startswith("user:"))
+              for user, stages in report["users"].items() if user != ""}
+    print("Slowest users:")
+    for user, seconds in sorted(totals.items(), key=lambda item: -item[1])[:slowest_users]:
+        print("\t{:<44} {:10.3f}s".format(user, seconds))
+
 
 ###################################################################
 # INITIAL DATA SETUP ROUTINES
 ###################################################################
 
 
-def copy_useful_data_to_workspace(tmp_data_path: str, workspace_data_path: str):
+def copy_useful_data_to_workspace(tmp_data_path: str, workspace_data_path: str, mode: str = "copy",
+                                  workers: int = 16):
+    """
+    can be re-run / restarted after an interruption: existing directories are reused, files whose copy already has
+    the same size and modification time are skipped and every file is written to a temporary ".part" file first
+
+    @param mode:    "copy", "hardlink" or "reflink" (copy on write clone, linux only). links fall back to copying if
+                    not supported (e.g. different file systems). careful: hardlinked files share their content with
+                    the downloaded data, changing one changes both
+    @param workers: number of threads, the import is bound by per file overhead rather than bandwidth
+    """
     dir_list = os.listdir(tmp_data_path)
     useful_dir_counter = 0
+    tasks = []
     for dir in dir_list:
         if "labels.txt" in os.listdir(tmp_data_path + dir):
             useful_dir_counter += 1
-            os.mkdir(workspace_data_path + dir)
-            shutil.copy(tmp_data_path + dir + "/labels.txt", workspace_data_path + dir + "/labels.txt")
-            os.mkdir(workspace_data_path + dir + "/Trajectory")
-            for trajectory in os.listdir(tmp_data_path + dir + "/Trajectory"):
-                shutil.copy(tmp_data_path + dir + "/Trajectory/" + trajectory,
-                            workspace_data_path + dir + "/Trajectory/" + trajectory)
-
-    print("Number of useful directories: {} (of {})".format(useful_dir_counter, len(dir_list)))
-
-
-def read_trajectory(trajectory_path: str):
-
-    timestamps = []
-    longitudes = []     # laengengrad in grad
-    latitudes = []      # breitengrad in grad
-    altitudes = []      # hoehe in feet ?!
+            os.makedirs(workspace_data_path + dir + "/Trajectory", exist_ok=True)
+            file_names = ["labels.txt"] + ["Trajectory/" + trajectory for trajectory in
+                                           os.listdir(tmp_data_path + dir + "/Trajectory")]
+            for file_name in file_names:
+                tasks.append((tmp_data_path + dir + "/" + file_name, workspace_data_path + dir + "/" + file_name))
+
+    copied_file_counter = 0
+    fallback_errors = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(import_file, source, target, mode) for source, target in tasks]
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            imported, fallback_error = future.result()
+            copied_file_counter += imported
+            if fallback_error is not None:
+                fallback_errors.append(fallback_error)
+
+    print("Number of useful directories: {} (of {}), imported files: {} (of {})".format(
+        useful_dir_counter, len(dir_list), copied_file_counter, len(tasks)))
+    if fallback_errors:
+        print("{} files were copied instead of using mode {} (first error: {})".format(
+            len(fallback_errors), mode, fallback_errors[0]))
+
+
+def import_file(source: str, target: str, mode: str = "copy"):
+    """
+    @return:    True if the file was imported (False if target already was up to date), the error of the link if mode
+                "hardlink" or "reflink" had to fall back to copying (else None)
+    """
+    if mode not in ("copy", "hardlink", "reflink"):
+        raise ValueError("unknown import mode: {}".format(mode))
+    if is_same_file_version(source, target):
+        return False, None
+
+    # leftovers of an interrupted run are overwritten:
+    tmp_path = target + ".part"
+    if os.path.lexists(tmp_path):
+        os.remove(tmp_path)
+
+    # only the links fall back to copying, errors of the copy itself (disk full, permissions, ...) are raised:
+    fallback_error = None
+    if mode != "copy":
+        try:
+            if mode == "hardlink":
+                os.link(source, tmp_path)
+            else:
+                reflink_file(source, tmp_path)
+        except OSError as error:
+            fallback_error = str(error)
+            if os.path.lexists(tmp_path):
+                os.remove(tmp_path)
+    if mode == "copy" or fallback_error is not None:
+        shutil.copy2(source, tmp_path)
+
+    os.replace(tmp_path, target)
+    return True, fallback_error
+
+
+def reflink_file(source: str, target: str):
+    """
+    copy on write clone of source (btrfs, xfs, ...), raises OSError if not supported
+    """
+    if fcntl is None:
+        raise OSError("reflinks are not supported on this platform")
+    with open(source, "rb") as source_file, open(target, "wb") as target_file:
+        fcntl.ioctl(target_file.fileno(), FICLONE, source_file.fileno())
+    shutil.copystat(source, target)
 
 
-    with open(trajectory_path, "r") as file:
-        reader = csv.reader(file, delimiter=",")
+@instrumented
+def read_trajectory_arrays(trajectory_path: str, use_fractional_days: bool = False):
+    """
+    @param trajectory_path:     path to a .plt file
+    @param use_fractional_days: take the timestamps from the "days since 1899-12-30" column instead of the date and
+                                time columns (faster, only numeric columns have to be parsed)
+    @return:                    timestamps (datetime64[s], UTC), latitudes, longitudes, altitudes (float64 arrays)
 
-        for counter, row in enumerate(reader):
-            # skip first 6 rows:
-            if counter <= 5:
-                continue
+    bulk reader: skips the 6 header lines and parses all columns in one pass
+    """
+    if use_fractional_days:
+        data = np.loadtxt(trajectory_path, delimiter=",", skiprows=6, usecols=(0, 1, 3, 4), dtype=PLT_DTYPE_FAST,
+                          ndmin=1)
+        epochs = fractional_days_to_epoch(data["days"])
+    else:
+        data = np.loadtxt(trajectory_path, delimiter=",", skiprows=6, usecols=(0, 1, 3, 5, 6), dtype=PLT_DTYPE,
+                          ndmin=1)
+        epochs = parse_timestamps(data["date"], data["time"])
+    timestamps = epochs.astype("datetime64[s]")
+
+    latitudes = np.ascontiguousarray(data["latitude"])      # breitengrad in grad
+    longitudes = np.ascontiguousarray(data["longitude"])    # laengengrad in grad
+    altitudes = np.ascontiguousarray(data["altitude"])      # hoehe in feet ?!
 
-            # get timestamp:
-            date = row[5].split("-")
-            time = row[6].split(":")
-            dt = datetime(int(date[0]), int(date[1]), int(date[2]), int(time[0]), int(time[1]), int(time[2]))
-            timestamps.append(dt.timestamp())
+    return timestamps, latitudes, longitudes, altitudes
 
-            # get (3D) coordinates:
-            latitudes.append(float(row[0]))
-            longitudes.append(float(row[1]))
-            altitudes.append(float(row[3]))
 
-    return timestamps, latitudes, longitudes, altitudes
+def read_trajectory(trajectory_path: str):
+    """
+    list based wrapper around read_trajectory_arrays, timestamps are seconds since epoch (UTC)
+    """
+    timestamps, latitudes, longitudes, altitudes = read_trajectory_arrays(trajectory_path)
+    return (epoch_seconds(timestamps).tolist(), latitudes.tolist(), longitudes.tolist(),
+            altitudes.tolist())
 
 
+@instrumented
 def read_trajectory_labels(label_path: str):
-
-    timestamps_start = []
-    timestamps_end = []
+    """
+    @return:    start and end timestamps (seconds since epoch, UTC) and the label of every row of a labels.txt
+    """
+    dates = []
+    times = []
     labels = []
 
     with open(label_path, "r") as file:
@@ -82,129 +268,638 @@ def read_trajectory_labels(label_path: str):
         header = reader.__next__()
 
         for row in reader:
-            # get start / end timestamp:
+            # windows handling:
+            if not row:
+                continue
+
+            # get start / end timestamp ("yyyy/mm/dd hh:mm:ss"):
             for idx in range(2):
-                d = row[idx].split(" ")[0]
-                d = d.split("/")
-                t = row[idx].split(" ")[1]
-                t = t.split(":")
-                dt = datetime(int(d[0]), int(d[1]), int(d[2]), int(t[0]), int(t[1]), int(t[2]))
-                if idx == 0:
-                    timestamps_start.append(dt.timestamp())
-                else:
-                    timestamps_end.append(dt.timestamp())
+                d, t = row[idx].split(" ")
+                dates.append(d)
+                times.append(t)
 
             # get label:
             labels.append(row[2])
 
-    return timestamps_start, timestamps_end, labels
+    epochs = parse_timestamps(dates, times).astype(np.float64)
+    return epochs[0::2].tolist(), epochs[1::2].tolist(), labels
+
+
+@instrumented
+def label_trajectories(target_directory: str, force: bool = False):
+    """
+    for each user dir create a (huge) csv file containing all datapoints with their label, paths are divided by empty
+    rows. only needed as an export, the training data is created directly from iter_labeled_segments
+
+    @param force:   relabel even if labels.txt and the trajectory files did not change since the last run
+    @return:        number of trajectory points without label, None if labeled_trajectories.csv was up to date
+    """
+    inputs = trajectory_inputs(target_directory)
+    version = artifact_version("labeled_trajectories.csv")
+    if not force and is_up_to_date(target_directory, "labeled_trajectories.csv", version, inputs):
+        return None
+    signatures = input_signatures(target_directory, inputs)
+
+    statistics = {}
+    write_labeled_segments_csv(iter_labeled_segments(target_directory, statistics),
+                               target_directory + "/labeled_trajectories.csv")
+
+    record_artifact(target_directory, "labeled_trajectories.csv", version, signatures)
+    return statistics["unlabeled_points"]
 
 
-def label_trajectories(target_directory: str):
+@instrumented
+def assign_labels(timestamps, labels_t_start, labels_t_end):
+    """
+    @param timestamps:      timestamps of trajectory points (in any order)
+    @param labels_t_start:  start times of the label rows (in any order)
+    @param labels_t_end:    end times of the label rows, label intervals include both start and end time
+    @return:                index of the label row per point (int64 array), -1 for points without label
+
+    overlapping label rows are resolved deterministically: a point gets the covering label with the earliest start
+    time (on equal start times the earlier end time, then the earlier row)
+    """
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    starts = np.asarray(labels_t_start, dtype=np.float64)
+    ends = np.asarray(labels_t_end, dtype=np.float64)
+    if len(starts) == 0:
+        return np.full(timestamps.shape, -1, dtype=np.int64)
+
+    # sort label rows by start (then end, then row), lexsort is stable:
+    order = np.lexsort((ends, starts))
+    starts, ends = starts[order], ends[order]
+
+    # first label row k whose interval (or the one of an earlier row) reaches t, all rows before end before t:
+    covered_until = np.maximum.accumulate(ends)
+    k = np.searchsorted(covered_until, timestamps, side="left")
+
+    # t is labeled by row k if row k already started (ends[k] >= t holds by construction):
+    inside = k < len(starts)
+    inside[inside] = starts[k[inside]] <= timestamps[inside]
+
+    label_indices = np.full(timestamps.shape, -1, dtype=np.int64)
+    label_indices[inside] = order[k[inside]]
+    return label_indices
+
+
+@instrumented
+def create_training_data_distance_time(target_directory: str, force: bool = False):
+    """
+    @param force:   rebuild even if labels.txt and the trajectory files did not change since the last run
+    @return:        True if the training data store was (re)built, False if it was up to date
+    """
+    inputs = trajectory_inputs(target_directory)
+    version = artifact_version(TRAINING_DATA_STORE)
+    if not force and is_up_to_date(target_directory, TRAINING_DATA_STORE, version, inputs):
+        return False
+    signatures = input_signatures(target_directory, inputs)
+
+    # collected trajectories, written to the binary store in the end:
+    all_labels, all_times, all_distances = [], [], []
 
-    # read label file and initialize label index:
+    for segment in iter_labeled_segments(target_directory):
+        times, distances = segment_times_and_distances(segment)
+        all_labels.append(segment.label)
+        all_times.append(times)
+        all_distances.append(distances)
+
+    write_training_data_store(target_directory + "/" + TRAINING_DATA_STORE, all_labels, all_times, all_distances)
+    record_artifact(target_directory, TRAINING_DATA_STORE, version, signatures)
+    return True
+
+
+def convert_training_data_to_store(target_directory: str):
+    """
+    one-shot conversion of an old (eval based) training_data.txt into the binary training data store
+
+    @return:    number of converted trajectories, number of malformed rows that could not be read (not converted)
+    """
+    statistics = {}
+    data_tuples = read_training_data(target_directory + "/training_data.txt", statistics)
+    write_training_data_store(target_directory + "/" + TRAINING_DATA_STORE,
+                              [tup[2] for tup in data_tuples],
+                              [tup[0] for tup in data_tuples],
+                              [tup[1] for tup in data_tuples])
+    return len(data_tuples), statistics["skipped_rows"]
+
+
+@instrumented
+def interpolate_training_data(target_directory: str, frequency: float, window_length: int = 60):
+    """
+    resamples every trajectory of a user to a fixed frequency and cuts it into non overlapping windows, the result is
+    stored in interpolated_data.npz:
+    windows:            distance travelled per sample step [m], shape (number of windows, window_length), float32
+    labels:             label per window
+    segment_indices:    index of the trajectory in the training data store per window
+
+    @param frequency:       samples per second
+    @param window_length:   number of sample steps per window
+    @return:                number of windows
+    """
+    store = read_training_data_store(target_directory + "/" + TRAINING_DATA_STORE)
+    samples, sample_offsets = resample_segments(store.times, store.distances, store.offsets, frequency)
+    windows, segment_indices = cut_windows(samples, sample_offsets, window_length)
+
+    np.savez(target_directory + "/interpolated_data.npz",
+             windows=(0.01 * windows).astype(np.float32),
+             labels=store.labels[segment_indices],
+             segment_indices=segment_indices,
+             frequency=frequency)
+    return len(segment_indices)
+
+
+###################################################################
+# LABELED SEGMENTS (STREAMING)
+###################################################################
+
+
+LabeledSegment = namedtuple("LabeledSegment", ["label", "timestamps", "latitudes", "longitudes", "altitudes"])
+
+
+def trajectory_file_names(target_directory: str):
+    """
+    @return:    .plt file names of a user, sorted by time (unfinished imports etc. are ignored)
+    """
+    names = [name for name in os.listdir(target_directory + "/Trajectory") if name.endswith(".plt")]
+    return sorted(names, key=lambda x: int(x.split(".")[0]))
+
+
+def trajectory_inputs(target_directory: str):
+    """
+    @return:    input files (relative to target_directory) of everything derived from the labeled segments
+    """
+    return ["labels.txt"] + ["Trajectory/" + name for name in trajectory_file_names(target_directory)]
+
+
+def iter_labeled_segments(target_directory: str, statistics: dict = None):
+    """
+    @param target_directory:    user directory with labels.txt and the Trajectory directory
+    @param statistics:          optional dict, "unlabeled_points" is set to the number of points without label
+    @return:                    generator of LabeledSegment, one per contiguous run of points with the same label row
+
+    reads one .plt file at a time, so memory is bounded by the largest file plus the segment that is still open
+    (a segment may continue in the next file)
+    """
     labels_t_start, labels_t_end, labels_labels = read_trajectory_labels(target_directory + "/labels.txt")
-    label_index = 0
 
     # get sorted trajectory filenames
-    sorted_trajectory_names = os.listdir(target_directory + "/Trajectory")
-    sorted_trajectory_names = sorted(sorted_trajectory_names, key=lambda x: int(x.split(".")[0]))
+    sorted_trajectory_names = trajectory_file_names(target_directory)
+
+    unlabeled_points = 0
+
+    # label row and column pieces of the segment that is still open:
+    open_label_index, open_pieces = -1, []
+
+    def close_segment():
+        columns = [np.concatenate(column) for column in zip(*open_pieces)]
+        return LabeledSegment(labels_labels[open_label_index], *columns)
+
+    for file_name in sorted_trajectory_names:
+        timestamps, latitudes, longitudes, altitudes = read_trajectory_arrays(
+            target_directory + "/Trajectory/" + file_name)
+        times = epoch_seconds(timestamps)
+        label_indices = assign_labels(times, labels_t_start, labels_t_end)
+
+        labeled = label_indices >= 0
+        unlabeled_points += int(np.count_nonzero(~labeled))
+        label_indices = label_indices[labeled]
+        columns = (times[labeled], latitudes[labeled], longitudes[labeled], altitudes[labeled])
+
+        # split into runs of the same label row:
+        bounds = np.concatenate(([0], np.flatnonzero(np.diff(label_indices)) + 1, [len(label_indices)]))
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            if start == end:
+                continue
+            if label_indices[start] != open_label_index:
+                if open_pieces:
+                    yield close_segment()
+                open_label_index, open_pieces = label_indices[start], []
+            open_pieces.append([column[start:end] for column in columns])
 
-    # open file to write into:
-    with open(target_directory + "/labeled_trajectories.csv", "w") as csv_file:
+    if open_pieces:
+        yield close_segment()
+
+    if statistics is not None:
+        statistics["unlabeled_points"] = unlabeled_points
+
+
+def segment_times_and_distances(segment: LabeledSegment):
+    """
+    @return:    time differences [s] and distances [cm] between consecutive points, both as int
+    """
+    # time differences truncated like int(t_1 - t_0):
+    times = np.diff(segment.timestamps).astype(np.int64)
+    # distances in cm as int (rounded):
+    distances = np.floor(100 * gps_segment_distances(segment.latitudes, segment.longitudes) + 0.5).astype(np.int64)
+    return times, distances
+
+
+def write_labeled_segments_csv(segments, path: str):
+    """
+    sink writing segments in the labeled_trajectories.csv format:
+    one row per point (timestamp, latitude, longitude, altitude, label), segments are divided by empty rows
+    """
+    with open(path, "w") as csv_file:
         writer = csv.writer(csv_file, delimiter="\t")
+        for segment in segments:
+            columns = [column.tolist() for column in segment[1:]]
+            writer.writerows([t, lat, long, alt, segment.label] for t, lat, long, alt in zip(*columns))
+            writer.writerow(["", "", "", "", ""])
 
-        # used for finishing function:
-        finished_label_file = False
 
-        # iterate through gps path files:
-        for file_name in sorted_trajectory_names:
+###################################################################
+# RESAMPLING
+###################################################################
+# all trajectories of a user are processed at once: they are laid out one after another on a single time axis
+# (separated by a gap), so one np.interp call resamples every trajectory
 
-            if finished_label_file:
-                break
 
-            # get trajectory:
-            times, latitudes, longitudes, altitudes = read_trajectory(target_directory + "/Trajectory/" + file_name)
+def resample_segments(times, distances, offsets, frequency: float):
+    """
+    @param times:       time differences of all segments (flat, as in the training data store)
+    @param distances:   distances of all segments (flat, as in the training data store)
+    @param offsets:     segment i consists of times[offsets[i]:offsets[i+1]]
+    @param frequency:   samples per second
+    @return:            cumulative distance at every sample (flat) and sample offsets per segment (same layout)
+    """
+    times = np.maximum(np.asarray(times, dtype=np.float64), 0)
+    distances = np.asarray(distances, dtype=np.float64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    n_segments = len(offsets) - 1
+    gap = 1.0
+
+    # one more point than differences per segment, each segment starts with a step of "gap" / distance 0:
+    point_offsets = offsets + np.arange(n_segments + 1)
+    time_steps = np.insert(times, offsets[:-1], gap)
+    distance_steps = np.insert(distances, offsets[:-1], 0)
+    if len(time_steps) > 0:
+        time_steps[0] = 0
+
+    point_times = np.cumsum(time_steps)
+    point_distances = np.cumsum(distance_steps)
+    segment_lengths = np.diff(point_offsets)
+
+    # cumulative distance restarting at 0 for every segment:
+    point_distances -= np.repeat(point_distances[point_offsets[:-1]], segment_lengths)
+
+    # sample grid k / frequency for every segment, k = 0 ... floor(duration * frequency):
+    segment_starts = point_times[point_offsets[:-1]]
+    segment_durations = point_times[point_offsets[1:] - 1] - segment_starts
+    n_samples = np.floor(segment_durations * frequency).astype(np.int64) + 1
+    sample_offsets = np.zeros(n_segments + 1, dtype=np.int64)
+    np.cumsum(n_samples, out=sample_offsets[1:])
+
+    k = np.arange(sample_offsets[-1]) - np.repeat(sample_offsets[:-1], n_samples)
+    sample_times = np.repeat(segment_starts, n_samples) + k / frequency
+
+    if n_segments == 0:
+        return np.zeros(0), sample_offsets
+    return np.interp(sample_times, point_times, point_distances), sample_offsets
+
+
+def cut_windows(samples, sample_offsets, window_length: int):
+    """
+    @param samples:         cumulative distance at every sample (from resample_segments)
+    @param sample_offsets:  sample offsets per segment
+    @param window_length:   number of sample steps per window (window_length + 1 samples)
+    @return:                distance per sample step, shape (number of windows, window_length), and the segment index
+                            of every window. incomplete windows at the end of a segment are dropped
+    """
+    n_steps = np.maximum(np.diff(sample_offsets) - 1, 0)
+    n_windows = n_steps // window_length
+    segment_indices = np.repeat(np.arange(len(n_windows)), n_windows)
 
-            for t, lat, long, alt in zip(times, latitudes, longitudes, altitudes):
+    window_offsets = np.zeros(len(n_windows) + 1, dtype=np.int64)
+    np.cumsum(n_windows, out=window_offsets[1:])
+    j = np.arange(window_offsets[-1]) - np.repeat(window_offsets[:-1], n_windows)
+
+    first_samples = sample_offsets[segment_indices] + j * window_length
+    windows = samples[first_samples[:, None] + np.arange(window_length + 1)]
+    return np.diff(windows, axis=1), segment_indices
 
-                # skip all labels of past times:
-                try:
-                    while labels_t_end[label_index] < t:
-                        # divide different paths:
-                        writer.writerow(["", "", "", "", ""])
-                        label_index += 1
-                # thrown if labels.txt reaches end:
-                except IndexError:
-                    finished_label_file = True
-                    break
 
-                # skip points below T_0:
-                if t < labels_t_start[label_index]:
-                    continue
+###################################################################
+# FEATURES
+###################################################################
+# fixed size feature vector per segment for the classification of the movement type, computed for all segments of
+# a user at once on the concatenated points (steps / differences across segment borders are dropped)
+
 
-                writer.writerow([t, lat, long, alt, labels_labels[label_index]])
+FEATURE_PERCENTILES = [10, 25, 50, 75, 90]
+FEATURE_SIGNALS = ["speed", "acceleration", "jerk", "heading_change"]
+FEATURE_NAMES = (["{}_p{}".format(signal, q) for signal in FEATURE_SIGNALS for q in FEATURE_PERCENTILES]
+                 + ["stop_ratio", "duration", "length", "points"])
 
+STOP_SPEED = 0.5            # [m/s], slower steps count as stop
+MIN_HEADING_DISTANCE = 1.0  # [m], shorter steps have no meaningful heading
 
-def create_training_data_distance_time(target_directory: str):
 
-    def reset_variables():
-        return "", [], [], ""
+@instrumented
+def extract_features(target_directory: str, force: bool = False):
+    """
+    writes features.npz (features: (number of segments, len(FEATURE_NAMES)) float32 matrix, labels, feature_names),
+    the rows have the same order as the training data store
+
+    @param force:   rebuild even if labels.txt and the trajectory files did not change since the last run
+    @return:        True if features.npz was (re)built, False if it was up to date
+    """
+    inputs = trajectory_inputs(target_directory)
+    version = artifact_version("features.npz", FEATURE_PERCENTILES, FEATURE_SIGNALS, STOP_SPEED, MIN_HEADING_DISTANCE)
+    if not force and is_up_to_date(target_directory, "features.npz", version, inputs):
+        return False
+    signatures = input_signatures(target_directory, inputs)
 
-    with open(target_directory + "/training_data.txt", "w") as out_file:
-        writer = csv.writer(out_file, delimiter=";")
+    segments = list(iter_labeled_segments(target_directory))
+    offsets = np.zeros(len(segments) + 1, dtype=np.int64)
+    np.cumsum([len(segment.timestamps) for segment in segments], out=offsets[1:])
 
-        with open(target_directory + "/labeled_trajectories.csv", "r") as csv_file:
-            reader = csv.reader(csv_file, delimiter="\t")
+    def concatenate(column):
+        return np.concatenate([getattr(segment, column) for segment in segments] + [np.zeros(0)])
 
-            # init variables to store data:
-            label, distances, times, row_tmp = reset_variables()
+    features = extract_segment_features(concatenate("timestamps"), concatenate("latitudes"),
+                                        concatenate("longitudes"), offsets)
+    np.savez(target_directory + "/features.npz",
+             features=features.astype(np.float32),
+             labels=np.array([segment.label for segment in segments], dtype=np.str_),
+             feature_names=np.array(FEATURE_NAMES))
 
-            # iterate through trajectory file:
-            for row in tqdm(reader):
+    record_artifact(target_directory, "features.npz", version, signatures)
+    return True
 
-                # windows support (extra empty lines are generated using windows):
-                if not row:
-                    continue
 
-                # check for end of trajectory
-                if row[0] == "":
-                    # store trajectory and reset variables:
-                    if label != "":
-                        writer.writerow([label, times, distances])
-                    label, distances, times, row_tmp = reset_variables()
+def extract_segment_features(timestamps, latitudes, longitudes, offsets):
+    """
+    @param timestamps:  [s] of all points (flat)
+    @param latitudes:   of all points (flat)
+    @param longitudes:  of all points (flat)
+    @param offsets:     segment i consists of the points offsets[i]:offsets[i+1]
+    @return:            feature matrix (number of segments, len(FEATURE_NAMES)), NaN where a segment is too short
+    """
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    n_segments = len(offsets) - 1
+    point_segments = np.repeat(np.arange(n_segments), np.diff(offsets))
+
+    # steps between consecutive points of the same segment:
+    step_segments, (dt, distances, headings, step_times) = next_differences(
+        point_segments, np.diff(timestamps), gps_segment_distances(latitudes, longitudes),
+        gps_segment_headings(latitudes, longitudes), (timestamps[:-1] + timestamps[1:]) / 2)
+    speeds = segment_speeds(dt, distances)
+
+    # differences between consecutive steps (and consecutive accelerations):
+    acceleration_segments, (d_speed, d_step_time, heading_changes, step_distances, acceleration_times) = \
+        next_differences(step_segments, np.diff(speeds), np.diff(step_times), angle_differences(headings),
+                         np.minimum(distances[:-1], distances[1:]), (step_times[:-1] + step_times[1:]) / 2)
+    # rates of change per second (same computation as a speed):
+    accelerations = segment_speeds(d_step_time, d_speed)
+    jerk_segments, (d_acceleration, d_acceleration_time) = next_differences(
+        acceleration_segments, np.diff(accelerations), np.diff(acceleration_times))
+    jerks = segment_speeds(d_acceleration_time, d_acceleration)
+
+    moving = step_distances >= MIN_HEADING_DISTANCE
+    signals = [(speeds, step_segments), (accelerations, acceleration_segments), (jerks, jerk_segments),
+               (heading_changes[moving], acceleration_segments[moving])]
+    percentiles = [segment_percentiles(values, segments, n_segments, FEATURE_PERCENTILES)
+                   for values, segments in signals]
+
+    # time share of steps slower than STOP_SPEED:
+    durations = np.bincount(step_segments, weights=dt, minlength=n_segments)
+    stop_times = np.bincount(step_segments, weights=np.where(speeds < STOP_SPEED, dt, 0), minlength=n_segments)
+    stop_ratios = np.full(n_segments, np.nan)
+    np.divide(stop_times, durations, out=stop_ratios, where=durations > 0)
+    lengths = np.bincount(step_segments, weights=distances, minlength=n_segments)
+
+    return np.column_stack(percentiles + [stop_ratios, durations, lengths, np.diff(offsets)])
+
+
+def next_differences(segments, *columns):
+    """
+    @param segments:    segment id per element
+    @param columns:     values computed from consecutive elements (one element less than segments)
+    @return:            segment ids and columns of the pairs of consecutive elements within the same segment
+    """
+    same_segment = segments[:-1] == segments[1:]
+    return segments[:-1][same_segment], [np.asarray(column)[same_segment] for column in columns]
 
-                # add data if row is not empty:
-                else:
-                    # get label if not yet set:
-                    if label == "":
-                        label = row[4]
 
-                    # add time difference:
-                    if row_tmp != "":
-                        times.append(int(float(row[0])-float(row_tmp[0])))
+def gps_segment_headings(latitudes, longitudes):
+    """
+    @return:    heading [degree, 0 = north, clockwise] from every point to the next one
+    """
+    latitudes = np.radians(np.asarray(latitudes, dtype=np.float64))
+    longitudes = np.radians(np.asarray(longitudes, dtype=np.float64))
+    d_long = np.diff(longitudes)
+    y = np.sin(d_long) * np.cos(latitudes[1:])
+    x = np.cos(latitudes[:-1]) * np.sin(latitudes[1:]) - np.sin(latitudes[:-1]) * np.cos(latitudes[1:]) * np.cos(d_long)
+    return np.degrees(np.arctan2(y, x))
 
-                    # add distance:
-                    if row_tmp != "":
-                        p1 = [float(row_tmp[1]), float(row_tmp[2])]
-                        p2 = [float(row[1]), float(row[2])]
-                        distances.append(int(100*gps_distance(p1, p2)+0.5))  # TODO: now in cm as int
 
-                    # store row for next step:
-                    row_tmp = row
+def angle_differences(headings):
+    """
+    @return:    absolute change [degree, 0 ... 180] between consecutive headings
+    """
+    return np.abs((np.diff(headings) + 180) % 360 - 180)
 
 
-def interpolate_training_data(target_directory: str, frequency: float):
-    data_tuples = read_training_data(target_directory + "/training_data.txt")
-    d0 = data_tuples[0]
-    print(d0[0])
-    print(d0[1])
-    # TODO: think about how the data should be passed
-    # d0 = data_tuples[50]
-    # new_times = np.arange(1/frequency, np.sum(d0[0]), 1/frequency)
+def segment_percentiles(values, segments, n_segments: int, percentiles: list):
+    """
+    percentiles (linear interpolation, like np.percentile) of the values of every segment at once
 
-    # print(new_times.shape)
-    # print(np.interp(new_times, d0[0], d0[1]))
+    @param segments:    segment id per value, NaN values are ignored
+    @return:            (n_segments, len(percentiles)), NaN for segments without values
+    """
+    values = np.asarray(values, dtype=np.float64)
+    finite = np.isfinite(values)
+    values, segments = values[finite], segments[finite]
+
+    order = np.lexsort((values, segments))
+    values = values[order]
+    counts = np.bincount(segments, minlength=n_segments)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+
+    result = np.full((n_segments, len(percentiles)), np.nan)
+    has_values = counts > 0
+    for column, q in enumerate(percentiles):
+        position = starts[has_values] + q / 100 * (counts[has_values] - 1)
+        lower = np.floor(position).astype(np.int64)
+        upper = np.minimum(lower + 1, starts[has_values] + counts[has_values] - 1)
+        fraction = position - lower
+        result[has_values, column] = values[lower] * (1 - fraction) + values[upper] * fraction
+    return result
+
+
+###################################################################
+# SPATIAL INDEX
+###################################################################
+# uniform lat/lon grid over all labeled points of the dataset, stored as flat arrays sorted by grid cell:
+# the points of cell cell_ids[i] are latitudes[cell_offsets[i]:cell_offsets[i+1]] (same for all point columns),
+# segment_ids refer to segment_users, segment_numbers (index of the segment in the user's training data store) and
+# segment_label_codes
+
+
+SPATIAL_INDEX_ARRAYS = ["cell_ids", "cell_offsets", "latitudes", "longitudes", "timestamps", "label_codes",
+                        "segment_ids", "labels", "users", "segment_users", "segment_numbers", "segment_label_codes"]
+
+SpatialIndex = namedtuple("SpatialIndex", ["cell_size"] + SPATIAL_INDEX_ARRAYS)
+
+
+def grid_cells(latitudes, longitudes, cell_size: float):
+    """
+    @return:    row and column of the grid cell of every point
+    """
+    rows = np.floor((np.asarray(latitudes) + 90) / cell_size).astype(np.int64)
+    columns = np.floor((np.asarray(longitudes) + 180) / cell_size).astype(np.int64)
+    return rows, columns
+
+
+def spatial_index_points(target_directory: str):
+    """
+    @return:    all labeled points of a user as flat arrays (input of build_spatial_index)
+    """
+    segments = list(iter_labeled_segments(target_directory))
+    lengths = [len(segment.timestamps) for segment in segments]
+    return {"latitudes": np.concatenate([segment.latitudes for segment in segments] + [np.zeros(0)]),
+            "longitudes": np.concatenate([segment.longitudes for segment in segments] + [np.zeros(0)]),
+            "timestamps": np.concatenate([segment.timestamps for segment in segments] + [np.zeros(0)]).astype(np.int64),
+            "segment_numbers": np.repeat(np.arange(len(segments)), lengths),
+            "segment_labels": [segment.label for segment in segments]}
+
+
+def build_spatial_index(directories: list, index_path: str, cell_size: float = 0.01, workers: int = None):
+    """
+    @param directories: user directories
+    @param index_path:  directory the index is written to
+    @param cell_size:   edge length of a grid cell [degree], 0.01 is roughly 1km
+    @return:            number of indexed points
+    """
+    summary = run_pipeline(spatial_index_points, directories, workers=workers)
+    print_pipeline_summary(summary)
+
+    users, columns = [], {name: [] for name in ["latitudes", "longitudes", "timestamps", "segment_ids"]}
+    segment_users, segment_numbers, segment_labels = [], [], []
+    for directory in sorted(summary.results):
+        points = summary.results[directory]
+        n_segments = len(points["segment_labels"])
+        for name in ["latitudes", "longitudes", "timestamps"]:
+            columns[name].append(points[name])
+        columns["segment_ids"].append(points["segment_numbers"] + len(segment_labels))
+        segment_users.append(np.full(n_segments, len(users)))
+        segment_numbers.append(np.arange(n_segments))
+        segment_labels.extend(points["segment_labels"])
+        users.append(os.path.basename(os.path.normpath(directory)))
+    columns = {name: np.concatenate(arrays + [np.zeros(0)]) for name, arrays in columns.items()}
+
+    labels, segment_label_codes = np.unique(np.array(segment_labels, dtype=np.str_), return_inverse=True)
+    segment_label_codes = segment_label_codes.reshape(-1).astype(np.int16)
+    segment_ids = columns["segment_ids"].astype(np.int64)
+
+    # sort points by grid cell:
+    rows, grid_columns = grid_cells(columns["latitudes"], columns["longitudes"], cell_size)
+    point_cells = rows * grid_size(cell_size)[1] + grid_columns
+    order = np.argsort(point_cells, kind="stable")
+    cell_ids, cell_starts = np.unique(point_cells[order], return_index=True)
+
+    arrays = {"cell_ids": cell_ids,
+              "cell_offsets": np.append(cell_starts, len(order)).astype(np.int64),
+              "latitudes": columns["latitudes"][order],
+              "longitudes": columns["longitudes"][order],
+              "timestamps": columns["timestamps"][order].astype(np.int64),
+              "label_codes": segment_label_codes[segment_ids[order]],
+              "segment_ids": segment_ids[order],
+              "labels": labels,
+              "users": np.array(users, dtype=np.str_),
+              "segment_users": np.concatenate(segment_users + [np.zeros(0, dtype=np.int64)]).astype(np.int32),
+              "segment_numbers": np.concatenate(segment_numbers + [np.zeros(0, dtype=np.int64)]).astype(np.int32),
+              "segment_label_codes": segment_label_codes}
+
+    os.makedirs(index_path, exist_ok=True)
+    for name, array in arrays.items():
+        np.save(index_path + "/" + name + ".npy", array)
+    with open(index_path + "/meta.json", "w") as file:
+        json.dump({"cell_size": cell_size}, file)
+    return len(order)
+
+
+def grid_size(cell_size: float):
+    """
+    @return:    number of grid rows and columns
+    """
+    return int(math.ceil(180 / cell_size)) + 1, int(math.ceil(360 / cell_size)) + 1
+
+
+def read_spatial_index(index_path: str, mmap: bool = True):
+    with open(index_path + "/meta.json", "r") as file:
+        cell_size = json.load(file)["cell_size"]
+    mmap_mode = "r" if mmap else None
+    return SpatialIndex(cell_size, *[np.load(index_path + "/" + name + ".npy", mmap_mode=mmap_mode)
+                                     for name in SPATIAL_INDEX_ARRAYS])
+
+
+def query_bounding_box(index: SpatialIndex, lat_min: float, lat_max: float, long_min: float, long_max: float,
+                       labels: list = None):
+    """
+    @param long_min, long_max:  long_min > long_max selects a box crossing the 180th meridian
+    @param labels:              only return points with one of these labels (default: all)
+    @return:                    sorted indices of all points inside the box (into the point arrays of the index)
+    """
+    # candidate cells: only the non empty cells are checked, never the whole grid:
+    n_columns = grid_size(index.cell_size)[1]
+    cell_rows, cell_columns = np.divmod(np.asarray(index.cell_ids), n_columns)
+    (row_min, row_max), (column_min, column_max) = grid_cells([lat_min, lat_max], [long_min, long_max],
+                                                              index.cell_size)
+    in_rows = (cell_rows >= row_min) & (cell_rows <= row_max)
+    if long_min <= long_max:
+        in_columns = (cell_columns >= column_min) & (cell_columns <= column_max)
+    else:
+        in_columns = (cell_columns >= column_min) | (cell_columns <= column_max)
+    cells = np.flatnonzero(in_rows & in_columns)
+
+    # indices of all points of the candidate cells:
+    starts, ends = index.cell_offsets[cells], index.cell_offsets[cells + 1]
+    counts = ends - starts
+    candidates = np.repeat(starts - np.cumsum(np.append(0, counts[:-1])), counts) + np.arange(np.sum(counts))
+
+    # exact filter:
+    latitudes, longitudes = index.latitudes[candidates], index.longitudes[candidates]
+    inside = (latitudes >= lat_min) & (latitudes <= lat_max)
+    if long_min <= long_max:
+        inside &= (longitudes >= long_min) & (longitudes <= long_max)
+    else:
+        inside &= (longitudes >= long_min) | (longitudes <= long_max)
+    if labels is not None:
+        label_codes = np.flatnonzero(np.isin(index.labels, labels))
+        inside &= np.isin(index.label_codes[candidates], label_codes)
+    return candidates[inside]
+
+
+def query_radius(index: SpatialIndex, latitude: float, longitude: float, radius: float, labels: list = None):
+    """
+    @param radius:  [meter]
+    @return:        sorted indices of all points within radius around (latitude, longitude)
+    """
+    # bounding box of the circle, the full longitude range close to the poles:
+    d_lat = math.degrees(radius / R_EARTH)
+    lat_min, lat_max = max(latitude - d_lat, -90), min(latitude + d_lat, 90)
+    cos_lat = min(math.cos(math.radians(lat_min)), math.cos(math.radians(lat_max)))
+    if cos_lat <= 0 or d_lat / cos_lat >= 180:
+        long_min, long_max = -180, 180
+    else:
+        d_long = d_lat / cos_lat
+        long_min = (longitude - d_long + 180) % 360 - 180
+        long_max = (longitude + d_long + 180) % 360 - 180
+
+    candidates = query_bounding_box(index, lat_min, lat_max, long_min, long_max, labels)
+    distances = haversine(latitude, longitude, index.latitudes[candidates], index.longitudes[candidates])
+    return candidates[distances <= radius]
+
+
+def query_segments(index: SpatialIndex, point_indices):
+    """
+    @return:    (user, index in the user's training data store, label) of every segment with a point in point_indices
+    """
+    segment_ids = np.unique(index.segment_ids[point_indices])
+    return [(str(index.users[index.segment_users[segment_id]]), int(index.segment_numbers[segment_id]),
+             str(index.labels[index.segment_label_codes[segment_id]])) for segment_id in segment_ids.tolist()]
 
 
 ###################################################################
@@ -212,52 +907,145 @@ def interpolate_training_data(target_directory: str, frequency: float):
 ###################################################################
 
 
+# bin edges of the histograms in the dataset statistics (powers of 2),
+# histogram[0] counts values below 0.5, histogram[i] values in [STATS_BIN_EDGES[i-1], STATS_BIN_EDGES[i]):
+STATS_BIN_EDGES = 2.0 ** np.arange(-1, 32)
+
+
+def distribution_summary(values):
+    """
+    @return:    mergeable summary (count, sum, min, max, histogram) of the values
+    """
+    values = np.asarray(values, dtype=np.float64)
+    histogram = np.bincount(np.searchsorted(STATS_BIN_EDGES, values, side="right"),
+                            minlength=len(STATS_BIN_EDGES) + 1)
+    return {"count": len(values),
+            "sum": float(np.sum(values)),
+            "min": float(np.min(values)) if len(values) > 0 else None,
+            "max": float(np.max(values)) if len(values) > 0 else None,
+            "histogram": histogram.tolist()}
+
+
+def merge_distribution_summaries(a: dict, b: dict):
+    return {"count": a["count"] + b["count"],
+            "sum": a["sum"] + b["sum"],
+            "min": min([x for x in (a["min"], b["min"]) if x is not None], default=None),
+            "max": max([x for x in (a["max"], b["max"]) if x is not None], default=None),
+            "histogram": [x + y for x, y in zip(a["histogram"], b["histogram"])]}
+
+
+@instrumented
+def compute_user_stats(target_directory: str):
+    """
+    statistics of one user in a single pass over the training data store:
+    label histogram and distributions of trajectory lengths, time spans [s] and sampling intervals [s]
+
+    @return:    partial statistics, can be combined with merge_stats
+    """
+    store = read_training_data_store(target_directory + "/" + TRAINING_DATA_STORE)
+    times = np.asarray(store.times, dtype=np.int64)
+
+    lengths = np.diff(store.offsets)
+    cumulative_times = np.concatenate(([0], np.cumsum(times)))
+    time_spans = cumulative_times[store.offsets[1:]] - cumulative_times[store.offsets[:-1]]
+    labels, label_counts = np.unique(store.labels, return_counts=True)
+
+    user = {"user": os.path.basename(os.path.normpath(target_directory)), "trajectories": len(lengths)}
+    if len(lengths) > 0:
+        non_empty = lengths > 0
+        user.update({"mean_length": float(np.mean(lengths)),
+                     "max_length": int(np.max(lengths)),
+                     "mean_time_span_s": float(np.mean(time_spans)),
+                     "max_time_span_s": int(np.max(time_spans)),
+                     "mean_time_step_s": float(np.mean(time_spans[non_empty] / lengths[non_empty]))
+                     if np.any(non_empty) else None})
+
+    return {"users": [user],
+            "labels": {label: int(count) for label, count in zip(labels.tolist(), label_counts.tolist())},
+            "trajectory_lengths": distribution_summary(lengths),
+            "time_spans_s": distribution_summary(time_spans),
+            "sampling_intervals_s": distribution_summary(times)}
+
+
+def empty_stats():
+    return {"users": [], "labels": {}, "trajectory_lengths": distribution_summary([]),
+            "time_spans_s": distribution_summary([]), "sampling_intervals_s": distribution_summary([])}
+
+
+def merge_stats(a: dict, b: dict):
+    labels = dict(a["labels"])
+    for label, count in b["labels"].items():
+        labels[label] = labels.get(label, 0) + count
+
+    return {"users": a["users"] + b["users"],
+            "labels": labels,
+            "trajectory_lengths": merge_distribution_summaries(a["trajectory_lengths"], b["trajectory_lengths"]),
+            "time_spans_s": merge_distribution_summaries(a["time_spans_s"], b["time_spans_s"]),
+            "sampling_intervals_s": merge_distribution_summaries(a["sampling_intervals_s"], b["sampling_intervals_s"])}
+
+
+def compute_dataset_stats(directories: list, workers: int = None):
+    """
+    computes the statistics of all users in parallel (see run_pipeline) and merges them
+    """
+    summary = run_pipeline(compute_user_stats, directories, workers=workers)
+    print_pipeline_summary(summary)
+
+    stats = empty_stats()
+    for directory in sorted(summary.results):
+        stats = merge_stats(stats, summary.results[directory])
+    return stats
+
+
+def write_stats_report(stats: dict, report_path: str):
+    """
+    writes <report_path>.json (complete statistics) and <report_path>.csv (one row per user)
+    """
+    with open(report_path + ".json", "w") as file:
+        json.dump(dict(stats, bin_edges=STATS_BIN_EDGES.tolist()), file, indent=1)
+
+    columns = ["user", "trajectories", "mean_length", "max_length", "mean_time_span_s", "max_time_span_s",
+               "mean_time_step_s"]
+    with open(report_path + ".csv", "w", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=columns, delimiter="\t")
+        writer.writeheader()
+        writer.writerows(stats["users"])
+
+
 def get_user_stats_paths_and_times():
     user_path = "../_shared_data/GPSLabels/trajectories/"
-    for dir in sorted([dir for dir in os.listdir(user_path)], key=lambda dir: int(dir)):
-        data = read_training_data(user_path + dir + "/training_data.txt")
-        lens = []
-        ts = []
-        tsteps = []
-        for tup in data:
-            lens.append(len(tup[0]))
-            ts.append(np.sum(tup[0]))
-            if len(tup[0]) > 0:
-                tsteps.append(np.mean(tup[0]))
-        if len(lens) > 0:
-            out_str = "{}: Num tras: {}\t Mean tra len: {}\t Max tra len: {}\t mean time span: {}min\t max time span: {}min\t mean time step size: {}s"
-            print(out_str.format(dir, len(data), int(np.mean(lens)), np.max(lens), int(np.mean(ts)/60), int(np.max(ts)/60), int(np.mean(tsteps))))
+    dirs = [user_path + dir for dir in os.listdir(user_path)]
+    stats = compute_dataset_stats(dirs)
+    out_str = "{}: Num tras: {}\t Mean tra len: {}\t Max tra len: {}\t mean time span: {}min\t max time span: {}min\t mean time step size: {}s"
+    for user in sorted(stats["users"], key=lambda user: int(user["user"])):
+        if user["trajectories"] > 0 and user["mean_time_step_s"] is not None:
+            print(out_str.format(user["user"], user["trajectories"], int(user["mean_length"]), user["max_length"],
+                                 int(user["mean_time_span_s"] / 60), int(user["max_time_span_s"] / 60),
+                                 int(user["mean_time_step_s"])))
         else:
-            print("{}: skipped".format(dir))
+            print("{}: skipped".format(user["user"]))
 
 
 def get_user_stats_labels():
     user_path = "../_shared_data/GPSLabels/trajectories/"
-    labels = []
-    for dir in tqdm(sorted([dir for dir in os.listdir(user_path)], key=lambda dir: int(dir))):
-        data = read_training_data(user_path + dir + "/training_data.txt")
-        for tup in data:
-            labels.append(tup[2])
-
-    distinct_labels = set(labels)
-    for dl in distinct_labels:
-        dlc = labels.count(dl)
-        print("Label: {} \t Appearance: {}".format(dl, dlc))
+    dirs = [user_path + dir for dir in os.listdir(user_path)]
+    stats = compute_dataset_stats(dirs)
+    for label, count in sorted(stats["labels"].items()):
+        print("Label: {} \t Appearance: {}".format(label, count))
 
 
 ###################################################################
 # VISUALIZATION
 ###################################################################
 
-def show_trajectory(label: str, times, distances):
-    factor_to_meters = 0.01
-
-    times = np.array(times)
-    distances = np.array(distances) * factor_to_meters
-    velos = distances / times
-
-    times_added = np.cumsum(times)
-    distances_added = np.cumsum(distances)
+def show_trajectory(label: str, times, distances, pixel_width: int = None, method: str = "lttb"):
+    """
+    @param pixel_width: if set, the curve is downsampled to this pixel budget before plotting (see downsample)
+    """
+    times_added, velos = speed_curve(times, distances)
+    if pixel_width is not None:
+        indices = downsample(times_added, velos, pixel_width, method)
+        times_added, velos = times_added[indices], velos[indices]
 
     # plt.plot(times_added, distances_added)
     # plt.title(label)
@@ -272,6 +1060,136 @@ def show_trajectory(label: str, times, distances):
     plt.show()
 
 
+def speed_curve(times, distances):
+    """
+    @param times:       time differences [s]
+    @param distances:   distances [cm]
+    @return:            cumulative time [s] and speed [m/s] of every step, steps without valid speed are dropped
+    """
+    factor_to_meters = 0.01
+
+    times = np.array(times)
+    distances = np.array(distances) * factor_to_meters
+    velos = segment_speeds(times, distances)
+    times_added = np.cumsum(times)
+
+    valid = np.isfinite(velos)
+    return times_added[valid], velos[valid]
+
+
+def render_trajectory(label: str, times, distances, image_path: str, pixel_width: int = 800, method: str = "lttb"):
+    """
+    non interactive version of show_trajectory: the downsampled speed curve is written to image_path
+    (does not use pyplot, so it works headless and in worker processes)
+    """
+    times_added, velos = speed_curve(times, distances)
+    indices = downsample(times_added, velos, pixel_width, method)
+
+    fig = Figure(figsize=(pixel_width / 100, 3), dpi=100)
+    ax = fig.subplots()
+    ax.plot(times_added[indices], velos[indices], "-")
+    ax.set_title(label)
+    ax.set_xlabel("t [s]")
+    ax.set_ylabel("speed [m/s]")
+    fig.tight_layout()
+    fig.savefig(image_path)
+
+
+def render_training_data(target_directory: str, output_directory: str, labels: list = None, pixel_width: int = 800,
+                         method: str = "lttb", workers: int = 1):
+    """
+    renders every trajectory of a user's training data store to <output_directory>/<label>/<user>_<index>.png
+
+    @param labels:  only render trajectories with one of these labels (default: all)
+    @param workers: number of worker processes
+    @return:        number of rendered trajectories
+    """
+    store = read_training_data_store(target_directory + "/" + TRAINING_DATA_STORE)
+    user = os.path.basename(os.path.normpath(target_directory))
+
+    tasks = []
+    for index in range(len(store.labels)):
+        times, distances, label = get_trajectory(store, index)
+        if labels is not None and label not in labels:
+            continue
+        os.makedirs(output_directory + "/" + label, exist_ok=True)
+        image_path = "{}/{}/{}_{:05d}.png".format(output_directory, label, user, index)
+        tasks.append((label, np.array(times), np.array(distances), image_path, pixel_width, method))
+
+    if workers == 1 or len(tasks) == 0:
+        for task in tasks:
+            render_trajectory(*task)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(render_trajectory, *zip(*tasks), chunksize=16))
+    return len(tasks)
+
+
+def downsample(x, y, pixel_width: int, method: str = "lttb"):
+    """
+    @param method:  "lttb" (largest triangle three buckets, one point per pixel) or
+                    "minmax" (minimum and maximum per pixel, keeps every peak)
+    @return:        sorted indices of the points to plot
+    """
+    if method == "lttb":
+        return downsample_lttb(x, y, pixel_width)
+    if method == "minmax":
+        return downsample_minmax(x, y, pixel_width)
+    raise ValueError("unknown downsampling method: {}".format(method))
+
+
+def downsample_lttb(x, y, n_out: int):
+    """
+    largest triangle three buckets: first and last point are kept, from every one of the n_out - 2 buckets in between
+    the point forming the largest triangle with the previously selected point and the mean of the next bucket
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    indices = np.zeros(n_out, dtype=np.int64)
+    indices[-1] = n - 1
+
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        next_start, next_end = (edges[i + 1], edges[i + 2]) if i + 2 < len(edges) else (n - 1, n)
+        mean_x, mean_y = np.mean(x[next_start:next_end]), np.mean(y[next_start:next_end])
+
+        a = indices[i]
+        areas = np.abs((x[a] - mean_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (mean_y - y[a]))
+        indices[i + 1] = start + np.argmax(areas)
+
+    return indices
+
+
+def downsample_minmax(x, y, n_out: int):
+    """
+    splits the x range into n_out / 2 buckets of equal width (one per pixel column, independent of the sampling rate)
+    and keeps the minimum and maximum of each non empty bucket (plus first and last point)
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(y)
+    n_buckets = n_out // 2
+    if n <= n_out or n_buckets < 1:
+        return np.arange(n)
+
+    x_span = x[-1] - x[0]
+    if x_span > 0:
+        buckets = np.clip(np.floor((x - x[0]) / x_span * n_buckets), 0, n_buckets - 1).astype(np.int64)
+    else:
+        buckets = np.zeros(n, dtype=np.int64)
+    order = np.lexsort((y, buckets))
+    # buckets without points (gaps in the recording) have no start:
+    _, bucket_starts = np.unique(buckets[order], return_index=True)
+    minima = order[bucket_starts]
+    maxima = order[np.append(bucket_starts[1:], n) - 1]
+    return np.unique(np.concatenate(([0, n - 1], minima, maxima)))
+
+
 # TODO
 def create_map_with_marker():
     # OPEN STREET MAP: Overpass API
@@ -293,23 +1211,125 @@ def gps_distance(p1: list, p2: list):
     @return:        The Distance between the coordinate points [meter]
 
     """
-    r_earth = 6371000    # earth radius in meter
     p1_rad = [math.radians(x) for x in p1]
     p2_rad = [math.radians(x) for x in p2]
     d_haversine = haversine_distances([p1_rad, p2_rad])
-    d_real = d_haversine * r_earth
+    d_real = d_haversine * R_EARTH
     return d_real[0][1]
 
 
-def read_training_data(path: str):
+def gps_segment_distances(latitudes, longitudes):
+    """
+    @param latitudes:   latitudes of consecutive points in floating angular notation
+    @param longitudes:  longitudes of consecutive points in floating angular notation
+    @return:            distances between consecutive points [meter] (one element less than points)
+
+    vectorized haversine formula, same result as gps_distance for every pair of consecutive points
+    """
+    latitudes = np.asarray(latitudes, dtype=np.float64)
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+    return haversine(latitudes[:-1], longitudes[:-1], latitudes[1:], longitudes[1:])
+
+
+def haversine(lat_1, long_1, lat_2, long_2):
+    """
+    @return:    distances [meter] between the points (lat_1, long_1) and (lat_2, long_2) in floating angular notation,
+                all arguments may be arrays (broadcasted)
+    """
+    lat_1, long_1, lat_2, long_2 = [np.radians(np.asarray(x, dtype=np.float64)) for x in (lat_1, long_1, lat_2, long_2)]
+    a = np.sin((lat_2 - lat_1) / 2)**2 + np.cos(lat_1) * np.cos(lat_2) * np.sin((long_2 - long_1) / 2)**2
+    return 2 * R_EARTH * np.arcsin(np.sqrt(a))
+
+
+def segment_speeds(times, distances):
+    """
+    @param times:       time differences of consecutive points [s]
+    @param distances:   distances between consecutive points (e.g. from gps_segment_distances)
+    @return:            speed per segment in units of distances per second, NaN for non positive time differences
+    """
+    times = np.asarray(times, dtype=np.float64)
+    distances = np.asarray(distances, dtype=np.float64)
+    speeds = np.full(distances.shape, np.nan)
+    np.divide(distances, times, out=speeds, where=times > 0)
+    return speeds
+
+
+def day_epoch(date: str):
+    """
+    @param date:    "yyyy-mm-dd" or "yyyy/mm/dd"
+    @return:        seconds since epoch of 00:00:00 UTC of that day (cached)
+    """
+    epoch = DAY_EPOCH_CACHE.get(date)
+    if epoch is None:
+        epoch = calendar.timegm((int(date[0:4]), int(date[5:7]), int(date[8:10]), 0, 0, 0))
+        DAY_EPOCH_CACHE[date] = epoch
+    return epoch
+
+
+def parse_timestamps(dates, times):
+    """
+    @param dates:   "yyyy-mm-dd" or "yyyy/mm/dd" strings
+    @param times:   "hh:mm:ss" strings (zero padded)
+    @return:        seconds since epoch (int64), the dates and times are interpreted as UTC (independent of the host)
+
+    the epoch of a day is only looked up once per run of equal dates (consecutive .plt rows share the same date),
+    the seconds of the day are computed from the digits of all time strings at once
+    """
+    dates = np.asarray(dates, dtype=np.str_)
+    times = np.ascontiguousarray(times, dtype="U8")
+    if len(dates) == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    # epoch of the day per run of equal dates:
+    run_starts = np.concatenate(([0], np.flatnonzero(dates[1:] != dates[:-1]) + 1))
+    run_epochs = np.array([day_epoch(date) for date in dates[run_starts].tolist()], dtype=np.int64)
+    day_epochs = np.repeat(run_epochs, np.diff(np.append(run_starts, len(dates))))
+
+    # seconds of the day from the unicode code points of "hh:mm:ss":
+    digits = times.view(np.uint32).reshape(-1, 8).astype(np.int64) - ord("0")
+    if not np.all(digits[:, [2, 5]] == ord(":") - ord("0")):
+        raise ValueError("times have to be formatted as hh:mm:ss")
+    seconds = ((digits[:, 0] * 10 + digits[:, 1]) * 3600 + (digits[:, 3] * 10 + digits[:, 4]) * 60
+               + digits[:, 6] * 10 + digits[:, 7])
+
+    return day_epochs + seconds
+
+
+def fractional_days_to_epoch(days):
+    """
+    @param days:    fractional days since 1899-12-30 (5th column of a .plt file)
+    @return:        seconds since epoch (int64, rounded to full seconds)
+    """
+    return np.rint((np.asarray(days, dtype=np.float64) - DAYS_1899_TO_1970) * 86400).astype(np.int64)
+
+
+def epoch_seconds(timestamps: np.ndarray):
+    """
+    @return:    seconds since epoch (float64) of datetime64 timestamps
+    """
+    return timestamps.astype("datetime64[s]").astype(np.int64).astype(np.float64)
+
+
+@instrumented
+def read_training_data(path: str, statistics: dict = None):
+    """
+    reader for the old training_data.txt format, only needed by convert_training_data_to_store
+
+    @param statistics:  optional dict, "skipped_rows" is set to the number of malformed rows that were skipped
+    """
+    # trajectories with many points exceed the default field size limit (would be dropped otherwise):
+    csv.field_size_limit(2**31 - 1)
+
     with open(path, "r") as file:
         reader = csv.reader(file, delimiter=";")
         data_tuples = []
-        # special reading behaviour due to fields that may be too long an need error handling
+        skipped_rows = 0
+        # special reading behaviour due to malformed rows that need error handling
         while True:
             try:
                 row = next(reader)
             except csv.Error:
+                skipped_rows += 1
                 continue
             except StopIteration:
                 break
@@ -323,9 +1343,273 @@ def read_training_data(path: str):
             distances = eval(row[2], {"__builtins__": None}, {})    # careful with eval (security)
             data_tuples.append((times, distances, label))
 
+    if statistics is not None:
+        statistics["skipped_rows"] = skipped_rows
     return data_tuples
 
 
+###################################################################
+# TRAINING DATA STORE
+###################################################################
+# per user directory one flat array each for labels, times, distances and trajectory offsets:
+# trajectory i consists of times[offsets[i]:offsets[i+1]], distances[offsets[i]:offsets[i+1]] and labels[i]
+
+
+TRAINING_DATA_STORE = "training_data"
+
+TrainingDataStore = namedtuple("TrainingDataStore", ["labels", "times", "distances", "offsets"])
+
+
+@instrumented
+def write_training_data_store(store_path: str, labels: list, times: list, distances: list):
+    """
+    @param store_path:  directory of the store (created if necessary)
+    @param labels:      label per trajectory
+    @param times:       time differences [s] per trajectory
+    @param distances:   distances [cm] per trajectory
+    """
+    os.makedirs(store_path, exist_ok=True)
+
+    offsets = np.zeros(len(times) + 1, dtype=np.int64)
+    np.cumsum([len(t) for t in times], out=offsets[1:])
+
+    def flatten(sequences):
+        flat = np.zeros(offsets[-1], dtype=np.int32)
+        for idx, sequence in enumerate(sequences):
+            flat[offsets[idx]:offsets[idx + 1]] = sequence
+        return flat
+
+    np.save(store_path + "/labels.npy", np.array(labels, dtype=np.str_).reshape(-1))
+    np.save(store_path + "/times.npy", flatten(times))
+    np.save(store_path + "/distances.npy", flatten(distances))
+    np.save(store_path + "/offsets.npy", offsets)
+
+
+@instrumented
+def read_training_data_store(store_path: str, mmap: bool = True):
+    """
+    @param mmap:    memory-map the arrays instead of loading them (trajectories are only read when sliced)
+    """
+    mmap_mode = "r" if mmap else None
+    return TrainingDataStore(labels=np.load(store_path + "/labels.npy"),
+                             times=np.load(store_path + "/times.npy", mmap_mode=mmap_mode),
+                             distances=np.load(store_path + "/distances.npy", mmap_mode=mmap_mode),
+                             offsets=np.load(store_path + "/offsets.npy"))
+
+
+def get_trajectory(store: TrainingDataStore, index: int):
+    """
+    @return:    (times, distances, label) of one trajectory, same layout as the tuples of read_training_data
+    """
+    start, end = store.offsets[index], store.offsets[index + 1]
+    return store.times[start:end], store.distances[start:end], str(store.labels[index])
+
+
+###################################################################
+# MANIFEST (INCREMENTAL RE-INGEST)
+###################################################################
+# every user directory has a manifest.json that maps each derived artifact to the version of the code that built it and
+# the signatures (size, mtime and sha1) of the input files it was built from:
+# {"labeled_trajectories.csv": {"version": "2", "inputs": {"labels.txt": {"size": ..., "mtime_ns": ..., "sha1": ...},
+#                                                          ...}}, ...}
+
+
+MANIFEST_FILE = "manifest.json"
+
+# format version of every artifact, bump it whenever a code change alters the content of the artifact (artifacts built
+# with another version are rebuilt on the next run):
+# labeled_trajectories.csv 2: timestamps in UTC instead of local time
+ARTIFACT_VERSIONS = {"labeled_trajectories.csv": 2, TRAINING_DATA_STORE: 1, "features.npz": 1}
+
+
+def file_hash(path: str):
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def file_signature(path: str):
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha1": file_hash(path)}
+
+
+def signature_matches(path: str, signature: dict):
+    """
+    cheap check on size and mtime, the hash is only computed if the size matches but the mtime changed
+    (e.g. a file that was copied again without changes)
+    """
+    stat = os.stat(path)
+    if stat.st_size != signature["size"]:
+        return False
+    if stat.st_mtime_ns == signature["mtime_ns"]:
+        return True
+    return file_hash(path) == signature["sha1"]
+
+
+def is_same_file_version(source: str, target: str):
+    """
+    @return:    True if target exists and has the same size and modification time as source
+    """
+    if not os.path.isfile(target):
+        return False
+    source_stat, target_stat = os.stat(source), os.stat(target)
+    return source_stat.st_size == target_stat.st_size and source_stat.st_mtime_ns == target_stat.st_mtime_ns
+
+
+def artifact_version(artifact: str, *parameters):
+    """
+    @param parameters:  json serializable parameters the content of the artifact depends on
+    @return:            ARTIFACT_VERSIONS[artifact], extended by a hash of the parameters
+    """
+    version = str(ARTIFACT_VERSIONS[artifact])
+    if parameters:
+        version += "-" + hashlib.sha1(json.dumps(parameters).encode()).hexdigest()[:12]
+    return version
+
+
+def input_signatures(target_directory: str, inputs: list):
+    """
+    has to be called before building an artifact: inputs that change during the build then do not match the
+    recorded signatures and the artifact is rebuilt on the next run
+    """
+    return {name: file_signature(target_directory + "/" + name) for name in inputs}
+
+
+def load_manifest(target_directory: str):
+    try:
+        with open(target_directory + "/" + MANIFEST_FILE, "r") as file:
+            return json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def is_up_to_date(target_directory: str, artifact: str, version: str, inputs: list):
+    """
+    @param artifact:    file or directory name of the derived artifact, relative to target_directory
+    @param version:     current version of the artifact, see artifact_version
+    @param inputs:      file names of the inputs the artifact is built from, relative to target_directory
+    @return:            True if the artifact exists and was built by this version from exactly these (unchanged) inputs
+    """
+    if not os.path.exists(target_directory + "/" + artifact):
+        return False
+    recorded = load_manifest(target_directory).get(artifact)
+    if recorded is None or recorded.get("version") != version or set(recorded.get("inputs", {})) != set(inputs):
+        return False
+    return all(signature_matches(target_directory + "/" + name, recorded["inputs"][name]) for name in inputs)
+
+
+def record_artifact(target_directory: str, artifact: str, version: str, signatures: dict):
+    """
+    stores the version and the input signatures (taken with input_signatures before the build) of a (re)built artifact
+    in the manifest of target_directory
+    """
+    manifest = load_manifest(target_directory)
+    manifest[artifact] = {"version": version, "inputs": signatures}
+
+    # write to a temporary file first, so an interrupted run can not leave a broken manifest:
+    tmp_path = target_directory + "/" + MANIFEST_FILE + ".tmp"
+    with open(tmp_path, "w") as file:
+        json.dump(manifest, file, indent=1)
+    os.replace(tmp_path, target_directory + "/" + MANIFEST_FILE)
+
+
+###################################################################
+# PIPELINE
+###################################################################
+
+
+PipelineSummary = namedtuple("PipelineSummary", ["results", "errors", "seconds"])
+
+
+def run_user_task(function, directory: str):
+    """
+    runs one stage for one user directory, exceptions are returned instead of raised
+    (as well as the stage timings recorded during the task, see INSTRUMENTATION)
+    """
+    global CURRENT_USER
+    CURRENT_USER = os.path.basename(os.path.normpath(directory))
+    n_timings = len(STAGE_TIMINGS)
+    try:
+        with stage_timer("user:" + function.__name__):
+            result, error = function(directory), None
+    except Exception:
+        result, error = None, traceback.format_exc()
+    finally:
+        CURRENT_USER = ""
+
+    timings = STAGE_TIMINGS[n_timings:]
+    del STAGE_TIMINGS[n_timings:]
+    return directory, result, error, timings
+
+
+def run_isolated_user_task(function, directory: str):
+    """
+    run_user_task in a worker process of its own, a dying worker (e.g. killed when out of memory) only affects this
+    user and raises BrokenProcessPool
+    """
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        return executor.submit(run_user_task, function, directory).result()
+
+
+def run_pipeline(function, directories: list, workers: int = None):
+    """
+    @param function:    stage executed for every user directory, e.g. label_trajectories (has to be a module level
+                        function so it can be sent to the worker processes)
+    @param directories: user directories
+    @param workers:     number of worker processes (default: number of cores), 1 runs everything in this process
+    @return:            PipelineSummary with the return values of all successful users, the tracebacks of all failed
+                        users (a failing user does not abort the run) and the total wall time
+
+    if a worker process dies, the pool is broken and all its unfinished users are run again, each in a worker process
+    of its own (see run_isolated_user_task), so only the users whose worker died are reported as failed
+    """
+    workers = workers or os.cpu_count() or 1
+    results, errors = {}, {}
+    t_start = time.perf_counter()
+
+    def collect(task_result):
+        directory, result, error, timings = task_result
+        STAGE_TIMINGS.extend(timings)
+        if error is None:
+            results[directory] = result
+        else:
+            errors[directory] = error
+
+    if workers == 1:
+        for directory in tqdm(directories, desc=function.__name__):
+            collect(run_user_task(function, directory))
+    else:
+        unfinished = []
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(run_user_task, function, directory): directory for directory in directories}
+            for future in tqdm(as_completed(futures), total=len(futures), desc=function.__name__):
+                try:
+                    collect(future.result())
+                except BrokenProcessPool:
+                    unfinished.append(futures[future])
+
+        if unfinished:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = {executor.submit(run_isolated_user_task, function, directory): directory
+                           for directory in unfinished}
+                for future in tqdm(as_completed(futures), total=len(futures), desc=function.__name__ + " (retry)"):
+                    try:
+                        collect(future.result())
+                    except BrokenProcessPool:
+                        errors[futures[future]] = "worker process died (e.g. killed when out of memory)\n"
+
+    return PipelineSummary(results=results, errors=errors, seconds=time.perf_counter() - t_start)
+
+
+def print_pipeline_summary(summary: PipelineSummary):
+    print("Processed {} users in {:.1f}s ({} failed)".format(len(summary.results) + len(summary.errors),
+                                                           summary.seconds, len(summary.errors)))
+    for directory in sorted(summary.errors):
+        print("{}:\n{}".format(directory, summary.errors[directory]))
+
+
 ###################################################################
 # MAIN FUNCTIONS / ENTRY POINT
 ###################################################################
@@ -366,15 +1650,65 @@ def main_label_data():
             os.listdir("../_shared_data/GPSLabels/trajectories")]
     # dirs = ["C:/Users/Julius/PycharmProjects/_shared_data/GPSLabels/trajectories/" + directory for directory in
     #         os.listdir("C:/Users/Julius/PycharmProjects/_shared_data/GPSLabels/trajectories")]
-    for directory in tqdm(dirs):
-        label_trajectories(directory)
+    summary = run_pipeline(label_trajectories, dirs)
+    print_pipeline_summary(summary)
+    relabeled = {directory: n for directory, n in summary.results.items() if n is not None}
+    print("Relabeled users: {}, points without label: {}".format(len(relabeled), sum(relabeled.values())))
 
 
 def main_create_training_data():
     # data_path = "../_shared_data/GPSLabels/trajectories/"
     data_path = "C:/Users/Julius/PycharmProjects/_shared_data/GPSLabels/trajectories/"
-    for dir in os.listdir(data_path):
-        create_training_data_distance_time(data_path + dir)
+    dirs = [data_path + dir for dir in os.listdir(data_path)]
+    print_pipeline_summary(run_pipeline(create_training_data_distance_time, dirs))
+
+
+def main_convert_training_data():
+    data_path = "../_shared_data/GPSLabels/trajectories/"
+    for dir in tqdm(os.listdir(data_path)):
+        if os.path.isfile(data_path + dir + "/training_data.txt"):
+            converted, skipped = convert_training_data_to_store(data_path + dir)
+            if skipped > 0:
+                print("{}: {} malformed rows skipped ({} trajectories converted)".format(dir, skipped, converted))
+
+
+def main_dataset_stats():
+    """
+    machine readable replacement of the hand written "data investigation" file
+    """
+    data_path = "../_shared_data/GPSLabels/trajectories/"
+    stats = compute_dataset_stats([data_path + dir for dir in os.listdir(data_path)])
+    write_stats_report(stats, "data_investigation")
+
+
+def main_render_data():
+    """
+    renders all trajectories of every user to image files, sorted into one directory per label
+    """
+    data_path = "../_shared_data/GPSLabels/trajectories/"
+    for dir in tqdm(os.listdir(data_path)):
+        render_training_data(data_path + dir, "../_shared_data/GPSLabels/plots", workers=os.cpu_count())
+
+
+def main_spatial_index():
+    data_path = "../_shared_data/GPSLabels/trajectories/"
+    build_spatial_index([data_path + dir for dir in os.listdir(data_path)], "../_shared_data/GPSLabels/spatial_index")
+
+
+def main_extract_features():
+    data_path = "../_shared_data/GPSLabels/trajectories/"
+    print_pipeline_summary(run_pipeline(extract_features, [data_path + dir for dir in os.listdir(data_path)]))
+
+
+def main_timed_ingest():
+    """
+    re-creates the training data of every user and prints where the time went
+    """
+    enable_instrumentation()
+    data_path = "../_shared_data/GPSLabels/trajectories/"
+    dirs = [data_path + dir for dir in os.listdir(data_path)]
+    print_pipeline_summary(run_pipeline(create_training_data_distance_time, dirs))
+    print_timing_report()
 
 
 def main_interpolate_data():
@@ -386,6 +1720,12 @@ if __name__ == '__main__':
     # main_data_import()
     # main_label_data()
     # main_create_training_data()
+    # main_convert_training_data()
     # main_interpolate_data()
+    # main_dataset_stats()
+    # main_render_data()
+    # main_spatial_index()
+    # main_extract_features()
+    # main_timed_ingest()
     main()
 